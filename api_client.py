@@ -1,9 +1,143 @@
+import os
+import ijson
+import orjson
 import requests
 import logging
-from typing import Optional, Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Optional, Dict, Any, Iterator
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_MAX_INFLIGHT_REQUESTS = 8
+
+
+def _max_inflight_from_env() -> int:
+    """Read ARR_MAX_INFLIGHT, falling back to the default on invalid values"""
+    value = os.environ.get('ARR_MAX_INFLIGHT')
+    if value is None:
+        return DEFAULT_MAX_INFLIGHT_REQUESTS
+    try:
+        return max(1, int(value))
+    except ValueError:
+        logger.error('Invalid ARR_MAX_INFLIGHT value %r, using %s', value, DEFAULT_MAX_INFLIGHT_REQUESTS)
+        return DEFAULT_MAX_INFLIGHT_REQUESTS
+
+
+# Maximum number of concurrent requests sent to a single Sonarr/Radarr instance
+MAX_INFLIGHT_REQUESTS = _max_inflight_from_env()
+
+# (connect, read) timeouts in seconds; an unreachable host fails fast while slow
+# responses such as large series lists still get time to arrive
+REQUEST_TIMEOUT = (5, 30)
+
+# Longest Retry-After sleep honored; the sleep happens while an in-flight permit is held
+MAX_RETRY_AFTER_SECONDS = 10
+
+
+class CappedRetry(Retry):
+    """Retry policy that caps how long a Retry-After header can stall a request"""
+    
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, MAX_RETRY_AFTER_SECONDS)
+
+
+# Retry transient failures with exponential backoff, honoring Retry-After. Connect
+# and read failures get a single retry, so an unreachable host costs at most two
+# connect timeouts rather than four.
+RETRY_POLICY = CappedRetry(
+    total=3,
+    connect=1,
+    read=1,
+    backoff_factor=1,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=frozenset(['GET', 'PUT', 'DELETE']),
+    respect_retry_after_header=True,
+    raise_on_status=False
+)
+
+# Successful connection tests are remembered for this many seconds
+CONNECTION_CACHE_TTL = 60
+
+# Maximum number of remembered connection tests; the oldest is dropped first
+MAX_CACHED_CONNECTION_TESTS = 128
+
+# (ip_address, api_token) -> expiry timestamp of a successful connection test. With
+# a fixed TTL, insertion order is also expiry order.
+_connection_cache: 'OrderedDict[tuple, float]' = OrderedDict()
+_connection_cache_lock = threading.Lock()
+
+
+def _connection_cached(key: tuple) -> bool:
+    """Whether a connection test for a host and token succeeded recently"""
+    with _connection_cache_lock:
+        expires_at = _connection_cache.get(key)
+        if expires_at is None:
+            return False
+        if expires_at <= time.monotonic():
+            del _connection_cache[key]
+            return False
+        return True
+
+
+def _remember_connection(key: tuple):
+    """Remember a successful connection test, dropping expired and excess entries"""
+    now = time.monotonic()
+    with _connection_cache_lock:
+        _connection_cache.pop(key, None)
+        _connection_cache[key] = now + CONNECTION_CACHE_TTL
+        while _connection_cache:
+            oldest_key, expires_at = next(iter(_connection_cache.items()))
+            if expires_at > now and len(_connection_cache) <= MAX_CACHED_CONNECTION_TESTS:
+                break
+            del _connection_cache[oldest_key]
+
+# Maximum number of shared clients kept per process; the least recently used
+# one is closed once the limit is exceeded
+MAX_CACHED_CLIENTS = 32
+
+# Shared clients keyed by (ip_address, api_token, service_type) in LRU order. The
+# cache lives per worker process, so every gunicorn worker keeps its own
+# connection pools.
+_clients: 'OrderedDict[tuple, SonarrRadarrClient]' = OrderedDict()
+_clients_lock = threading.Lock()
+
+
+def get_client(ip_address: str, api_token: str, service_type: str) -> 'SonarrRadarrClient':
+    """Get a shared client for a Sonarr/Radarr instance, creating it on first use"""
+    key = (ip_address, api_token, service_type.lower())
+    evicted = None
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = SonarrRadarrClient(ip_address, api_token, service_type)
+            _clients[key] = client
+            if len(_clients) > MAX_CACHED_CLIENTS:
+                _, evicted = _clients.popitem(last=False)
+        else:
+            _clients.move_to_end(key)
+    if evicted is not None:
+        evicted.close()
+        logger.debug('Evicted least recently used client for %s at %s', evicted.service_type.title(), evicted.ip_address)
+    return client
+
+
+def evict_client(ip_address: str, api_token: str, service_type: str):
+    """Drop and close the shared client for a Sonarr/Radarr instance"""
+    key = (ip_address, api_token, service_type.lower())
+    with _clients_lock:
+        client = _clients.pop(key, None)
+    if client is not None:
+        client.close()
+        logger.debug('Evicted client for %s at %s', service_type.title(), ip_address)
+
+
 class SonarrRadarrClient:
     """Custom API client for Sonarr and Radarr"""
     
@@ -18,62 +152,120 @@ class SonarrRadarrClient:
         }
         
         # Set timeout for requests
-        self.timeout = 30
+        self.timeout = REQUEST_TIMEOUT
+        
+        # Reuse pooled keep-alive connections across requests
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=max(20, MAX_INFLIGHT_REQUESTS),
+            max_retries=RETRY_POLICY
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
+        # endpoint -> (ETag, parsed response) for conditional GETs
+        self._etag_cache: Dict[str, tuple] = {}
+        
+        # Bound in-flight requests so parallel sweeps don't overload the host
+        self._sem = threading.BoundedSemaphore(MAX_INFLIGHT_REQUESTS)
+    
+    def close(self):
+        """Close the underlying HTTP session"""
+        self.session.close()
+    
+    def __enter__(self):
+        return self
     
-    def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None) -> Optional[Dict]:
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None,
+                      params: Optional[Dict] = None, use_etag: bool = False,
+                      retry: bool = True) -> Optional[Dict]:
         """Make HTTP request to Sonarr/Radarr API"""
         url = f"{self.base_url}/{endpoint}"
         
         try:
-            logger.debug(f'Making {method} request to: {url}')
+            logger.debug('Making %s request to: %s', method, url)
             
-            if method.upper() == 'GET':
-                response = requests.get(url, headers=self.headers, timeout=self.timeout)
-            elif method.upper() == 'POST':
-                response = requests.post(url, headers=self.headers, json=data, timeout=self.timeout)
-            elif method.upper() == 'PUT':
-                response = requests.put(url, headers=self.headers, json=data, timeout=self.timeout)
-            elif method.upper() == 'DELETE':
-                response = requests.delete(url, headers=self.headers, timeout=self.timeout)
-            else:
-                logger.error(f'Unsupported HTTP method: {method}')
+            method = method.upper()
+            if method not in ('GET', 'POST', 'PUT', 'DELETE'):
+                logger.error('Unsupported HTTP method: %s', method)
                 return None
             
+            # Revalidate a previously fetched response instead of downloading it again
+            headers = None
+            cached = self._etag_cache.get(endpoint) if use_etag else None
+            if cached:
+                headers = {'If-None-Match': cached[0]}
+            
+            with self._sem:
+                if retry:
+                    response = self.session.request(
+                        method, url, params=params, json=data, headers=headers, timeout=self.timeout
+                    )
+                else:
+                    # A one-off request bypasses the session's retry policy
+                    response = requests.request(
+                        method, url, params=params, json=data, headers={**self.headers, **(headers or {})},
+                        timeout=self.timeout
+                    )
+            
+            if cached and response.status_code == 304:
+                logger.debug('Not modified, using cached response for: %s', url)
+                return cached[1]
+            
             response.raise_for_status()
             
             # Return JSON response if available
             try:
-                return response.json()
-            except ValueError:
+                result = orjson.loads(response.content)
+            except orjson.JSONDecodeError:
                 # Some endpoints don't return JSON
                 return {'status': 'success'}
+            
+            etag = response.headers.get('ETag') if use_etag else None
+            if etag:
+                self._etag_cache[endpoint] = (etag, result)
+            return result
                 
         except requests.exceptions.Timeout:
-            logger.error(f'Request timeout for {url}')
+            logger.error('Request timeout for %s', url)
         except requests.exceptions.ConnectionError:
-            logger.error(f'Connection error for {url}')
+            logger.error('Connection error for %s', url)
         except requests.exceptions.HTTPError as e:
-            logger.error(f'HTTP error for {url}: {str(e)}')
+            logger.error('HTTP error for %s: %s', url, e)
         except Exception as e:
-            logger.error(f'Unexpected error for {url}: {str(e)}')
+            logger.error('Unexpected error for %s: %s', url, e)
         
         return None
     
-    def test_connection(self) -> bool:
-        """Test connection to Sonarr/Radarr API"""
+    def test_connection(self, use_cache: bool = True) -> bool:
+        """Test connection to Sonarr/Radarr API, reusing a recent successful result"""
+        cache_key = (self.ip_address, self.api_token)
         try:
+            if use_cache and _connection_cached(cache_key):
+                logger.debug('Using cached connection test for %s at %s', self.service_type.title(), self.ip_address)
+                return True
+            
+            # Callers wait on the answer (e.g. the add-config form), so don't retry
             endpoint = 'system/status'
-            result = self._make_request('GET', endpoint)
+            result = self._make_request('GET', endpoint, retry=False)
             
             if result:
-                logger.info(f'Successfully connected to {self.service_type.title()} at {self.ip_address}')
+                logger.info('Successfully connected to %s at %s', self.service_type.title(), self.ip_address)
+                _remember_connection(cache_key)
                 return True
             else:
-                logger.error(f'Failed to connect to {self.service_type.title()} at {self.ip_address}')
+                logger.error('Failed to connect to %s at %s', self.service_type.title(), self.ip_address)
+                with _connection_cache_lock:
+                    _connection_cache.pop(cache_key, None)
                 return False
                 
         except Exception as e:
-            logger.error(f'Error testing connection: {str(e)}')
+            logger.error('Error testing connection: %s', e)
             return False
     
     def get_system_status(self) -> Optional[Dict]:
@@ -82,37 +274,12 @@ class SonarrRadarrClient:
     
     def unmonitor_episode(self, episode_id: int) -> bool:
         """Unmonitor a specific episode in Sonarr"""
-        if self.service_type != 'sonarr':
-            logger.error('unmonitor_episode called on non-Sonarr client')
-            return False
-        
-        try:
-            # First get the episode details
-            episode = self._make_request('GET', f'episode/{episode_id}')
-            if not episode:
-                logger.error(f'Could not retrieve episode {episode_id}')
-                return False
-            
-            # Update the episode to unmonitored
-            episode['monitored'] = False
-            
-            result = self._make_request('PUT', f'episode/{episode_id}', episode)
-            
-            if result:
-                logger.info(f'Successfully unmonitored Sonarr episode {episode_id}')
-                return True
-            else:
-                logger.error(f'Failed to unmonitor Sonarr episode {episode_id}')
-                return False
-                
-        except Exception as e:
-            logger.error(f'Error unmonitoring episode {episode_id}: {str(e)}')
-            return False
+        return self.unmonitor_episodes([episode_id])
         
     def unmonitor_episodes(self, episode_ids: list[int]) -> bool:
-        """Unmonitor a specific episode in Sonarr"""
+        """Unmonitor multiple episodes in Sonarr with a single request"""
         if self.service_type != 'sonarr':
-            logger.error('unmonitor_episode called on non-Sonarr client')
+            logger.error('unmonitor_episodes called on non-Sonarr client')
             return False
         if len(episode_ids) == 0:
             logger.error('There are no episodes')
@@ -129,72 +296,109 @@ class SonarrRadarrClient:
             result = self._make_request('PUT', f'episode/monitor', episodes)
             
             if result:
-                logger.info(f'Successfully unmonitored Sonarr episodes {len(episode_ids)}')
+                logger.info('Successfully unmonitored Sonarr episodes %s', len(episode_ids))
                 return True
             else:
-                logger.error(f'Failed to unmonitor Sonarr episodes {len(episode_ids)}')
+                logger.error('Failed to unmonitor Sonarr episodes %s', episode_ids)
                 return False
                 
         except Exception as e:
-            logger.error(f'Error unmonitoring episodes {len(episode_ids)}: {str(e)}')
+            logger.error('Error unmonitoring episodes %s: %s', episode_ids, e)
             return False
     
     def unmonitor_movie(self, movie_id: int) -> bool:
         """Unmonitor a specific movie in Radarr"""
+        return self.unmonitor_movies([movie_id])
+    
+    def unmonitor_movies(self, movie_ids: list[int]) -> bool:
+        """Unmonitor multiple movies in Radarr with a single request"""
         if self.service_type != 'radarr':
-            logger.error('unmonitor_movie called on non-Radarr client')
+            logger.error('unmonitor_movies called on non-Radarr client')
+            return False
+        if not isinstance(movie_ids, list):
+            logger.error('movie_ids is not list')
+            return False
+        if len(movie_ids) == 0:
+            logger.error('There are no movies')
             return False
         
         try:
-            # First get the movie details
-            movie = self._make_request('GET', f'movie/{movie_id}')
-            if not movie:
-                logger.error(f'Could not retrieve movie {movie_id}')
-                return False
-            
-            # Update the movie to unmonitored
-            movie['monitored'] = False
-            
-            result = self._make_request('PUT', f'movie/{movie_id}', movie)
+            movies = {
+                "movieIds": movie_ids,
+                "monitored": False
+            }
+            result = self._make_request('PUT', 'movie/editor', movies)
             
-            if result:
-                logger.info(f'Successfully unmonitored Radarr movie {movie_id}')
+            if result is not None:
+                logger.info('Successfully unmonitored Radarr movies %s', len(movie_ids))
                 return True
             else:
-                logger.error(f'Failed to unmonitor Radarr movie {movie_id}')
+                logger.error('Failed to unmonitor Radarr movies %s', movie_ids)
                 return False
                 
         except Exception as e:
-            logger.error(f'Error unmonitoring movie {movie_id}: {str(e)}')
+            logger.error('Error unmonitoring movies %s: %s', movie_ids, e)
             return False
     
-    def get_episodes(self, series_id: Optional[int] = None, custom_headers: list[str] = []) -> Optional[list]:
+    def _episode_params(self, series_id: Optional[int], extra_params: Optional[Dict]) -> Dict:
+        """Build query parameters for the episode endpoint"""
+        params = {}
+        if series_id:
+            params['seriesId'] = series_id
+        params.update(extra_params or {})
+        return params
+    
+    def get_episodes(self, series_id: Optional[int] = None, extra_params: Optional[Dict] = None) -> Optional[list]:
         """Get episodes from Sonarr"""
         if self.service_type != 'sonarr':
             return None
         
-        endpoint = 'episode'
-        q_added = False
-        if series_id:
-            endpoint += f'?seriesId={series_id}'
-            q_added = True
-
-        for custom_header in custom_headers:
-            endpoint += f"{'&' if q_added else '?'}{custom_header}"
-            if not q_added:
-                q_added = True
+        params = self._episode_params(series_id, extra_params)
         
-        result = self._make_request('GET', endpoint)
+        result = self._make_request('GET', 'episode', params=params)
         if isinstance(result, list):
             return result
         return None
     
-    def get_movies(self) -> Optional[list]:
+    def iter_episodes(self, series_id: Optional[int] = None, extra_params: Optional[Dict] = None) -> Iterator[Dict]:
+        """Stream episodes from Sonarr one at a time while the response is being received"""
+        if self.service_type != 'sonarr':
+            return
+        
+        params = self._episode_params(series_id, extra_params)
+        url = f"{self.base_url}/episode"
+        
+        # Errors are re-raised after logging, so a failed or truncated stream is
+        # never mistaken for a complete episode list
+        try:
+            logger.debug('Streaming GET request to: %s', url)
+            
+            with self._sem:
+                with self.session.get(url, params=params, stream=True, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    response.raw.decode_content = True
+                    yield from ijson.items(response.raw, 'item')
+                    
+        except requests.exceptions.Timeout:
+            logger.error('Request timeout for %s', url)
+            raise
+        except requests.exceptions.ConnectionError:
+            logger.error('Connection error for %s', url)
+            raise
+        except requests.exceptions.HTTPError as e:
+            logger.error('HTTP error for %s: %s', url, e)
+            raise
+        except Exception as e:
+            logger.error('Unexpected error for %s: %s', url, e)
+            raise
+    
+    def get_movies(self, cache_ok: bool = True) -> Optional[list]:
         """Get movies from Radarr"""
         if self.service_type != 'radarr':
             return None
         
-        result = self._make_request('GET', 'movie')
+        # Local cover paths are never used, skip them to shrink the payload
+        result = self._make_request('GET', 'movie', params={'excludeLocalCovers': 'true'}, use_etag=cache_ok)
         if isinstance(result, list):
             return result
         return None
@@ -211,12 +415,12 @@ class SonarrRadarrClient:
             return result
         return None
     
-    def get_series(self) -> Optional[list]:
+    def get_series(self, cache_ok: bool = True) -> Optional[list]:
         """Get series from Sonarr"""
         if self.service_type != 'sonarr':
             return None
         
-        result = self._make_request('GET', 'series')
+        result = self._make_request('GET', 'series', use_etag=cache_ok)
         if isinstance(result, list):
             return result
         return None
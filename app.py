@@ -1,19 +1,61 @@
 import os
+import uuid
 import logging
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from config_manager import ConfigManager
-from api_client import SonarrRadarrClient
+import threading
+import orjson
+import ahocorasick
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, render_template, request, redirect, url_for, flash
+from flask.json.provider import JSONProvider
+from config_manager import get_config_manager
+from api_client import SonarrRadarrClient, get_client, MAX_INFLIGHT_REQUESTS
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 # Create Flask app
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
 
 # Initialize configuration manager
-config_manager = ConfigManager("/app/config/configs.yaml")
+config_manager = get_config_manager("/app/config/configs.json")
+
+# Number of concurrent API calls used by force unmonitor sweeps, matched to
+# the client's in-flight limit so every worker has a pooled connection ready
+FORCE_UNMONITOR_WORKERS = MAX_INFLIGHT_REQUESTS
+
+# Only request the episode data the sweep needs; Sonarr cannot filter on
+# monitored state server-side, so that check stays in the sweep itself
+EPISODE_SWEEP_PARAMS = {"includeEpisodeFile": "true", "includeSeries": "false", "includeImages": "false"}
+
+# Force unmonitor sweeps run in the background so requests return immediately
+force_unmonitor_executor = ThreadPoolExecutor(max_workers=2)
+
+# job_id -> {'config_id': ..., 'status': running|done|failed}
+force_unmonitor_jobs = {}
+force_unmonitor_jobs_lock = threading.Lock()
+MAX_FORCE_UNMONITOR_JOBS = 100
+
+# Pre-encoded bodies for fixed JSON responses
+CONFIG_NOT_FOUND_JSON = orjson.dumps({'success': False, 'error': 'Configuration not found'})
+JOB_NOT_FOUND_JSON = orjson.dumps({'success': False, 'error': 'Job not found'})
+
+def _json_response(payload, status=200):
+    """Build a JSON response from a payload or a pre-encoded body"""
+    body = payload if isinstance(payload, bytes) else orjson.dumps(payload)
+    return Response(body, status=status, mimetype='application/json')
 
 @app.route('/')
 def index():
@@ -51,9 +93,11 @@ def add_config():
         else:
             quality_score = None
         
-        # Test API connection
-        client = SonarrRadarrClient(ip_address, api_token, service_type)
-        if not client.test_connection():
+        # Test API connection with a throwaway client, so a failed attempt
+        # doesn't leave a cached session behind
+        with SonarrRadarrClient(ip_address, api_token, service_type) as client:
+            connected = client.test_connection()
+        if not connected:
             flash(f'Could not connect to {service_type.title()} API. Please check IP address and API token.', 'error')
             return redirect(url_for('index'))
         
@@ -66,12 +110,15 @@ def add_config():
             quality_score=quality_score,
             format_name=format_name
         )
+        if webhook_token is None:
+            flash(f'Could not save configuration "{name}".', 'error')
+            return redirect(url_for('index'))
         
         flash(f'Configuration "{name}" added successfully. Webhook token: {webhook_token}', 'success')
-        logger.info(f'Added new {service_type} configuration: {name}')
+        logger.info('Added new %s configuration: %s', service_type, name)
         
     except Exception as e:
-        logger.error(f'Error adding configuration: {str(e)}')
+        logger.error('Error adding configuration: %s', e)
         flash(f'Error adding configuration: {str(e)}', 'error')
     
     return redirect(url_for('index'))
@@ -82,15 +129,17 @@ def delete_config(config_id):
     try:
         # Get config name for display before deletion
         config = config_manager.get_config(config_id)
-        config_name = config.get('name', 'Unknown') if config else 'Unknown'
+        config_name = config.name if config else 'Unknown'
         
         if config_manager.delete_config(config_id):
             flash(f'Configuration "{config_name}" deleted successfully.', 'success')
-            logger.info(f'Deleted configuration: {config_name}')
-        else:
+            logger.info('Deleted configuration: %s', config_name)
+        elif config is None:
             flash(f'Configuration not found.', 'error')
+        else:
+            flash(f'Could not delete configuration "{config_name}".', 'error')
     except Exception as e:
-        logger.error(f'Error deleting configuration: {str(e)}')
+        logger.error('Error deleting configuration: %s', e)
         flash(f'Error deleting configuration: {str(e)}', 'error')
     
     return redirect(url_for('index'))
@@ -102,46 +151,72 @@ def regenerate_token(config_name):
         new_token = config_manager.regenerate_webhook_token(config_name)
         if new_token:
             flash(f'Webhook token for "{config_name}" regenerated successfully.', 'success')
-            logger.info(f'Regenerated webhook token for: {config_name}')
-            return jsonify({'success': True, 'token': new_token})
+            logger.info('Regenerated webhook token for: %s', config_name)
+            return _json_response({'success': True, 'token': new_token})
         else:
             flash(f'Configuration "{config_name}" not found.', 'error')
-            return jsonify({'success': False, 'error': 'Configuration not found'})
+            return _json_response(CONFIG_NOT_FOUND_JSON)
     except Exception as e:
-        logger.error(f'Error regenerating token: {str(e)}')
+        logger.error('Error regenerating token: %s', e)
         flash(f'Error regenerating token: {str(e)}', 'error')
-        return jsonify({'success': False, 'error': str(e)})
+        return _json_response({'success': False, 'error': str(e)})
     
 @app.route('/force_unmonitor/<config_name>', methods=['POST'])
 def force_unmonitor(config_name):
-    """Regenerate webhook token for a configuration"""
+    """Start a background force unmonitor job for a configuration"""
     try:
         config = config_manager.get_config(config_name)
         if config:
-            service_type = config.get("service_type")
+            service_type = config.service_type
             if service_type == "sonarr":
-                result = process_sonarr_force_unmonitor(config)
-                if result:
-                    return jsonify({'success': True})
-                else:
-                    return jsonify({'success': False, 'error': 'Processing failed'})
+                process = process_sonarr_force_unmonitor
             elif service_type == "radarr":
-                result = process_radarr_force_unmonitor(config)
-                if result:
-                    return jsonify({'success': True})
-                else:
-                    return jsonify({'success': False, 'error': 'Processing failed'})
+                process = process_radarr_force_unmonitor
             else:
                 flash(f'Unknown service type "{service_type}"', 'error')
-                return jsonify({'success': False, 'error': f'Unknown service type "{service_type}"'})
-            logger.info(config)
+                return _json_response({'success': False, 'error': f'Unknown service type "{service_type}"'})
+            
+            job_id = str(uuid.uuid4())
+            with force_unmonitor_jobs_lock:
+                _prune_force_unmonitor_jobs()
+                force_unmonitor_jobs[job_id] = {'config_id': config_name, 'status': 'running'}
+            force_unmonitor_executor.submit(_run_force_unmonitor_job, job_id, process, config)
+            logger.info('Started force unmonitor job %s for: %s', job_id, config.name)
+            return _json_response({'success': True, 'job_id': job_id}, 202)
         else:
             flash(f'Configuration "{config_name}" not found.', 'error')
-            return jsonify({'success': False, 'error': 'Configuration not found'})
+            return _json_response(CONFIG_NOT_FOUND_JSON)
     except Exception as e:
-        logger.error(f'Error force unmonitoring: {str(e)}')
+        logger.error('Error force unmonitoring: %s', e)
         flash(f'Error force unmonitoring: {str(e)}', 'error')
-        return jsonify({'success': False, 'error': str(e)})
+        return _json_response({'success': False, 'error': str(e)})
+
+@app.route('/force_unmonitor/<job_id>/status', methods=['GET'])
+def force_unmonitor_status(job_id):
+    """Get the status of a force unmonitor job"""
+    with force_unmonitor_jobs_lock:
+        job = force_unmonitor_jobs.get(job_id)
+        status = job['status'] if job else None
+    if status is None:
+        return _json_response(JOB_NOT_FOUND_JSON, 404)
+    return _json_response({'success': True, 'status': status})
+
+def _run_force_unmonitor_job(job_id, process, config):
+    """Run a force unmonitor sweep and record its outcome"""
+    try:
+        status = 'done' if process(config) else 'failed'
+    except Exception as e:
+        logger.error('Error in force unmonitor job %s: %s', job_id, e)
+        status = 'failed'
+    with force_unmonitor_jobs_lock:
+        force_unmonitor_jobs[job_id]['status'] = status
+    logger.info('Force unmonitor job %s finished: %s', job_id, status)
+
+def _prune_force_unmonitor_jobs():
+    """Forget the oldest finished jobs once too many are tracked"""
+    finished = [job_id for job_id, job in force_unmonitor_jobs.items() if job['status'] != 'running']
+    for job_id in finished[:max(0, len(force_unmonitor_jobs) - MAX_FORCE_UNMONITOR_JOBS)]:
+        del force_unmonitor_jobs[job_id]
 
 @app.route('/sonarr', methods=['POST'])
 def sonarr_webhook():
@@ -155,18 +230,22 @@ def sonarr_webhook():
         
         # Find configuration by webhook token
         config = config_manager.get_config_by_token(webhook_token)
-        if not config or config['service_type'] != 'sonarr':
-            logger.warning(f'Sonarr webhook received with invalid token: {webhook_token}')
+        if not config or config.service_type != 'sonarr':
+            logger.warning('Sonarr webhook received with invalid token: %s', webhook_token)
             return 'Unauthorized', 401
         
         # Parse webhook data
-        webhook_data = request.get_json()
+        try:
+            webhook_data = orjson.loads(request.get_data())
+        except orjson.JSONDecodeError:
+            webhook_data = None
         if not webhook_data:
             logger.warning('Sonarr webhook received without JSON data')
             return 'Bad Request', 400
         
-        logger.info(f'Received Sonarr webhook for config: {config["name"]}')
-        logger.debug(f'Webhook data: {webhook_data}')
+        logger.info('Received Sonarr webhook for config: %s', config.name)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Webhook data: %s', webhook_data)
         
         # Process the webhook
         result = process_sonarr_webhook(config, webhook_data)
@@ -177,7 +256,7 @@ def sonarr_webhook():
             return 'Processing failed', 500
             
     except Exception as e:
-        logger.error(f'Error processing Sonarr webhook: {str(e)}')
+        logger.error('Error processing Sonarr webhook: %s', e)
         return 'Internal Server Error', 500
 
 @app.route('/radarr', methods=['POST'])
@@ -192,18 +271,22 @@ def radarr_webhook():
         
         # Find configuration by webhook token
         config = config_manager.get_config_by_token(webhook_token)
-        if not config or config['service_type'] != 'radarr':
-            logger.warning(f'Radarr webhook received with invalid token: {webhook_token}')
+        if not config or config.service_type != 'radarr':
+            logger.warning('Radarr webhook received with invalid token: %s', webhook_token)
             return 'Unauthorized', 401
         
         # Parse webhook data
-        webhook_data = request.get_json()
+        try:
+            webhook_data = orjson.loads(request.get_data())
+        except orjson.JSONDecodeError:
+            webhook_data = None
         if not webhook_data:
             logger.warning('Radarr webhook received without JSON data')
             return 'Bad Request', 400
         
-        logger.info(f'Received Radarr webhook for config: {config["name"]}')
-        logger.debug(f'Webhook data: {webhook_data}')
+        logger.info('Received Radarr webhook for config: %s', config.name)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Webhook data: %s', webhook_data)
         
         # Process the webhook
         result = process_radarr_webhook(config, webhook_data)
@@ -214,18 +297,57 @@ def radarr_webhook():
             return 'Processing failed', 500
             
     except Exception as e:
-        logger.error(f'Error processing Radarr webhook: {str(e)}')
+        logger.error('Error processing Radarr webhook: %s', e)
         return 'Internal Server Error', 500
 
+@lru_cache(maxsize=64)
+def _format_matcher(format_name):
+    """Build an Aho-Corasick automaton matching any of the comma-separated format names"""
+    # The whole value stays a needle too, so values stored before names could be
+    # comma-separated keep matching everything they matched before
+    needles = {needle.strip().lower() for needle in format_name.split(',')}
+    needles.add(format_name.strip().lower())
+    needles.discard('')
+    if not needles:
+        return None
+    automaton = ahocorasick.Automaton()
+    for needle in needles:
+        automaton.add_word(needle, needle)
+    automaton.make_automaton()
+    return automaton
+
+def _has_unmonitor_criteria(config):
+    """Check whether a config defines any criteria that could trigger an unmonitor"""
+    return config.quality_score is not None or bool(config.format_name)
+
+def _should_unmonitor(config, quality_score, format_names):
+    """Check whether an item's quality score or custom formats meet the config criteria"""
+    threshold = config.quality_score
+    if threshold is not None and quality_score >= threshold:
+        logger.info('Quality score %s meets requirement %s', quality_score, threshold)
+        return True
+    
+    matcher = _format_matcher(config.format_name) if config.format_name else None
+    if matcher:
+        for custom_format in format_names:
+            if next(matcher.iter(custom_format.lower()), None) is not None:
+                logger.info('Format name "%s" matches requirement "%s"', custom_format, config.format_name)
+                return True
+    
+    return False
+
 def process_sonarr_force_unmonitor(config):
     try:
-        client = SonarrRadarrClient(config['ip_address'], config['api_token'], 'sonarr')
-        to_unmonitor = []
-        for serie in client.get_series():
-            serie_id = serie.get("id")
-            if serie_id is None:
-                continue
-            for episode in client.get_episodes(serie_id, custom_headers=["includeEpisodeFile=true"]):
+        if not _has_unmonitor_criteria(config):
+            logger.debug('No unmonitor criteria configured for: %s', config.name)
+            return True
+        
+        client = get_client(config.ip_address, config.api_token, 'sonarr')
+        
+        def episodes_to_unmonitor(serie_id):
+            """Stream the episodes of a series and collect the ones meeting the criteria"""
+            matched = []
+            for episode in client.iter_episodes(serie_id, extra_params=EPISODE_SWEEP_PARAMS):
                 episode_id = episode.get("id")
                 if episode_id is None:
                     continue
@@ -241,43 +363,58 @@ def process_sonarr_force_unmonitor(config):
                 format_name = [cf["name"] for cf in episodeFile.get('customFormats', []) if cf.get("name")]
                 
                 # Check if quality criteria is met
-                should_unmonitor = False
-                
-                if config.get('quality_score') is not None:
-                    if quality_score >= config['quality_score']:
-                        should_unmonitor = True
-                        logger.info(f'Quality score {quality_score} meets requirement {config["quality_score"]}')
-                
-                if config.get('format_name') and format_name:
-                    for custom_format in format_name:
-                        if config['format_name'].lower() in custom_format.lower():
-                            should_unmonitor = True
-                            logger.info(f'Format name "{custom_format}" matches requirement "{config["format_name"]}"')
-                            break
+                should_unmonitor = _should_unmonitor(config, quality_score, format_name)
                 if should_unmonitor:
-                    to_unmonitor.append(episode_id)
+                    matched.append(episode_id)
+            return matched
+        
+        series = client.get_series()
+        if series is None:
+            logger.error('Failed to fetch series from Sonarr for: %s', config.name)
+            return False
+        
+        to_unmonitor = []
+        series_ids = [serie["id"] for serie in series if serie.get("id") is not None]
+        
+        # Scan all series concurrently, filtering episodes while they are being received
+        with ThreadPoolExecutor(max_workers=FORCE_UNMONITOR_WORKERS) as pool:
+            for episode_ids in pool.map(episodes_to_unmonitor, series_ids):
+                to_unmonitor.extend(episode_ids)
 
         if len(to_unmonitor) > 0:
             return client.unmonitor_episodes(to_unmonitor)
         return True
         
     except Exception as e:
-        logger.error(f'Error processing Sonarr force unmonitor: {str(e)}')
+        logger.error('Error processing Sonarr force unmonitor: %s', e)
         return False
     
 def process_radarr_force_unmonitor(config):
     try:
-        client = SonarrRadarrClient(config['ip_address'], config['api_token'], 'radarr')
-        for movie in client.get_movies():
-            movie_id = movie.get("id")
-            if movie_id is None:
-                continue
-            movie_file_id = movie.get("movieFileId")
-            if movie_file_id is None:
-                continue
-            if not movie.get("monitored", False):
-                continue
-            movie_file = client.get_movie_file(movie_file_id)
+        if not _has_unmonitor_criteria(config):
+            logger.debug('No unmonitor criteria configured for: %s', config.name)
+            return True
+        
+        client = get_client(config.ip_address, config.api_token, 'radarr')
+        all_movies = client.get_movies()
+        if all_movies is None:
+            logger.error('Failed to fetch movies from Radarr for: %s', config.name)
+            return False
+        
+        to_unmonitor = []
+        movies = [
+            movie for movie in all_movies
+            if movie.get("id") is not None
+            and movie.get("movieFileId") is not None
+            and movie.get("monitored", False)
+        ]
+        
+        # Fetch movie files concurrently, then filter them sequentially
+        with ThreadPoolExecutor(max_workers=FORCE_UNMONITOR_WORKERS) as pool:
+            movie_files = list(pool.map(lambda movie: client.get_movie_file(movie["movieFileId"]), movies))
+        
+        for movie, movie_file in zip(movies, movie_files):
+            movie_id = movie["id"]
             if movie_file is None:
                 continue
 
@@ -286,31 +423,16 @@ def process_radarr_force_unmonitor(config):
             format_name = [cf["name"] for cf in movie_file.get('customFormats', []) if cf.get("name")]
             
             # Check if quality criteria is met
-            should_unmonitor = False
-            
-            if config.get('quality_score') is not None:
-                if quality_score >= config['quality_score']:
-                    should_unmonitor = True
-                    logger.info(f'Quality score {quality_score} meets requirement {config["quality_score"]}')
-            
-            if config.get('format_name') and format_name:
-                for custom_format in format_name:
-                    if config['format_name'].lower() in custom_format.lower():
-                        should_unmonitor = True
-                        logger.info(f'Format name "{custom_format}" matches requirement "{config["format_name"]}"')
-                        break
+            should_unmonitor = _should_unmonitor(config, quality_score, format_name)
             if should_unmonitor:
-                success = client.unmonitor_movie(movie_id)
-                if success:
-                    logger.info(f'Successfully unmonitored Radarr movie ID: {movie_id}')
-                else:
-                    logger.error(f'Failed to unmonitor Radarr movie ID: {movie_id}')
-
+                to_unmonitor.append(movie_id)
 
+        if len(to_unmonitor) > 0:
+            return client.unmonitor_movies(to_unmonitor)
         return True
         
     except Exception as e:
-        logger.error(f'Error processing Radarr force unmonitor: {str(e)}')
+        logger.error('Error processing Radarr force unmonitor: %s', e)
         return False
 
 def process_sonarr_webhook(config, webhook_data):
@@ -319,7 +441,11 @@ def process_sonarr_webhook(config, webhook_data):
         # Check if this is a download event
         event_type = webhook_data.get('eventType')
         if event_type != 'Download':
-            logger.debug(f'Ignoring Sonarr webhook event type: {event_type}')
+            logger.debug('Ignoring Sonarr webhook event type: %s', event_type)
+            return True
+        
+        if not _has_unmonitor_criteria(config):
+            logger.debug('No unmonitor criteria configured for: %s', config.name)
             return True
         
         # Get episode and quality information
@@ -329,38 +455,21 @@ def process_sonarr_webhook(config, webhook_data):
         format_name = [cf["name"] for cf in quality.get('customFormats', []) if cf.get("name")]
         
         # Check if quality criteria is met
-        should_unmonitor = False
-        
-        if config.get('quality_score') is not None:
-            if quality_score >= config['quality_score']:
-                should_unmonitor = True
-                logger.info(f'Quality score {quality_score} meets requirement {config["quality_score"]}')
-        
-        if config.get('format_name') and format_name:
-            for custom_format in format_name:
-                if config['format_name'].lower() in custom_format.lower():
-                    should_unmonitor = True
-                    logger.info(f'Format name "{custom_format}" matches requirement "{config["format_name"]}"')
-                    break
+        should_unmonitor = _should_unmonitor(config, quality_score, format_name)
         
         if should_unmonitor:
-            # Initialize API client
-            client = SonarrRadarrClient(config['ip_address'], config['api_token'], 'sonarr')
+            # Get shared API client
+            client = get_client(config.ip_address, config.api_token, 'sonarr')
             
-            # Unmonitor each episode
-            for episode in episodes:
-                episode_id = episode.get('id')
-                if episode_id:
-                    success = client.unmonitor_episode(episode_id)
-                    if success:
-                        logger.info(f'Successfully unmonitored Sonarr episode ID: {episode_id}')
-                    else:
-                        logger.error(f'Failed to unmonitor Sonarr episode ID: {episode_id}')
+            # Unmonitor all episodes in a single request
+            episode_ids = [episode['id'] for episode in episodes if episode.get('id')]
+            if episode_ids:
+                client.unmonitor_episodes(episode_ids)
         
         return True
         
     except Exception as e:
-        logger.error(f'Error processing Sonarr webhook: {str(e)}')
+        logger.error('Error processing Sonarr webhook: %s', e)
         return False
 
 def process_radarr_webhook(config, webhook_data):
@@ -369,7 +478,11 @@ def process_radarr_webhook(config, webhook_data):
         # Check if this is a download event
         event_type = webhook_data.get('eventType')
         if event_type != 'Download':
-            logger.debug(f'Ignoring Radarr webhook event type: {event_type}')
+            logger.debug('Ignoring Radarr webhook event type: %s', event_type)
+            return True
+        
+        if not _has_unmonitor_criteria(config):
+            logger.debug('No unmonitor criteria configured for: %s', config.name)
             return True
         
         # Get movie and quality information
@@ -380,35 +493,19 @@ def process_radarr_webhook(config, webhook_data):
         format_name = [cf["name"] for cf in quality.get('customFormats', []) if cf.get("name")]
         
         # Check if quality criteria is met
-        should_unmonitor = False
-        
-        if config.get('quality_score') is not None:
-            if quality_score >= config['quality_score']:
-                should_unmonitor = True
-                logger.info(f'Quality score {quality_score} meets requirement {config["quality_score"]}')
-        
-        if config.get('format_name') and format_name:
-            for custom_format in format_name:
-                if config['format_name'].lower() in custom_format.lower():
-                    should_unmonitor = True
-                    logger.info(f'Format name "{custom_format}" matches requirement "{config["format_name"]}"')
-                    break
+        should_unmonitor = _should_unmonitor(config, quality_score, format_name)
         
         if should_unmonitor and movie_id:
-            # Initialize API client
-            client = SonarrRadarrClient(config['ip_address'], config['api_token'], 'radarr')
+            # Get shared API client
+            client = get_client(config.ip_address, config.api_token, 'radarr')
             
             # Unmonitor the movie
-            success = client.unmonitor_movie(movie_id)
-            if success:
-                logger.info(f'Successfully unmonitored Radarr movie ID: {movie_id}')
-            else:
-                logger.error(f'Failed to unmonitor Radarr movie ID: {movie_id}')
+            client.unmonitor_movies([movie_id])
         
         return True
         
     except Exception as e:
-        logger.error(f'Error processing Radarr webhook: {str(e)}')
+        logger.error('Error processing Radarr webhook: %s', e)
         return False
 
 if __name__ == '__main__':
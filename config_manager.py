@@ -1,118 +1,551 @@
 import os
+import mmap
 import yaml
-import uuid
+import orjson
+import secrets
+import atexit
 import logging
-from typing import Dict, List, Optional
+import tempfile
+import threading
+from contextlib import contextmanager
+from stat import S_IMODE
+from dataclasses import dataclass, asdict, fields, replace
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional
+from api_client import evict_client
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process locking, only a single writer process is supported
+    fcntl = None
 
 logger = logging.getLogger(__name__)
 
+# Process umask, read once at import since querying it means setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# Prefer the libyaml C implementation when PyYAML was built with it
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+Dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# The write-ahead log is folded into the configuration file once it grows past this size
+WAL_CHECKPOINT_BYTES = 1024 * 1024
+
+# Frozen so configurations handed out to callers stay read-only; mutators swap
+# in an updated copy instead
+@dataclass(slots=True, frozen=True)
+class Config:
+    """A single Sonarr/Radarr configuration"""
+    id: str
+    name: str
+    service_type: str
+    ip_address: str
+    api_token: str
+    webhook_token: str
+    quality_score: Optional[int] = None
+    format_name: Optional[str] = None
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Config':
+        """Build a configuration from stored data, ignoring unknown keys"""
+        return cls(**{key: data[key] for key in _CONFIG_FIELDS if key in data})
+
+_CONFIG_FIELDS = frozenset(field.name for field in fields(Config))
+
+# Fields that update_config is allowed to change
+_ALLOWED_UPDATE_KEYS = _CONFIG_FIELDS - {'id', 'webhook_token'}
+
+def _is_yaml(path: str) -> bool:
+    """Whether a configuration file is stored as YAML rather than JSON"""
+    return path.lower().endswith(('.yaml', '.yml'))
+
+def _to_configs(data: Dict) -> Dict[str, Config]:
+    """Convert parsed configuration data into Config instances"""
+    return {config_id: Config.from_dict(config) for config_id, config in data.items()}
+
+# Shared managers keyed by configuration file, so every module in a worker
+# process works on the same in-memory configurations
+_managers: Dict[str, 'ConfigManager'] = {}
+_managers_lock = threading.Lock()
+
+def get_config_manager(config_file: str = 'configs.json') -> 'ConfigManager':
+    """Get the shared manager for a configuration file, creating it on first use"""
+    with _managers_lock:
+        manager = _managers.get(config_file)
+        if manager is None:
+            manager = ConfigManager(config_file)
+            _managers[config_file] = manager
+        return manager
+
 class ConfigManager:
-    """Manage Sonarr/Radarr configurations in YAML file"""
+    """Manage Sonarr/Radarr configurations in a JSON (or legacy YAML) file"""
     
-    def __init__(self, config_file='configs.yaml'):
+    def __init__(self, config_file='configs.json'):
         self.config_file = config_file
-        self.configs = self._load_configs()
+        self._lock = threading.RLock()
+        
+        # Loaded lazily on first access, see the configs property
+        self._configs: Optional[Dict] = None
+        self._file_state: Optional[tuple] = None
+        self._by_token: Dict[str, str] = {}
+        self._by_name: Dict[str, str] = {}
+        
+        # Mutations are appended to a write-ahead log next to the configuration
+        # file, see _log_mutation
+        self.wal_file = os.path.splitext(config_file)[0] + '.wal'
+        self._pending: List[bytes] = []
+        self._dirty = False
+        self._batch_depth = 0
+        atexit.register(self.flush)
+        
+        # Writers in other processes are serialized through a lock file, see _locked
+        self.lock_file = os.path.splitext(config_file)[0] + '.lock'
+        self._lock_fd: Optional[int] = None
+        self._lock_depth = 0
     
-    def _load_configs(self) -> Dict:
-        """Load configurations from YAML file"""
+    @property
+    def configs(self) -> Dict:
+        """Configurations, loaded from disk on first access"""
+        if self._configs is None:
+            # Taking the lock loads them, see _locked
+            with self._locked():
+                pass
+        return self._configs
+    
+    @contextmanager
+    def _locked(self):
+        """Hold the thread lock and the cross-process file lock, syncing with other processes first"""
+        with self._lock:
+            if self._lock_depth == 0:
+                self._acquire_file_lock()
+                try:
+                    self._sync_from_disk()
+                except Exception:
+                    self._release_file_lock()
+                    raise
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    self._release_file_lock()
+    
+    def _acquire_file_lock(self):
+        """Take an exclusive lock on the lock file next to the configuration file"""
+        if fcntl is None:
+            return
+        try:
+            fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            logger.warning('Could not open lock file %s: %s', self.lock_file, e)
+            return
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        self._lock_fd = fd
+    
+    def _release_file_lock(self):
+        """Release the lock file, closing it drops the lock"""
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+    
+    def _sync_from_disk(self):
+        """Load configurations, or reload them if another process changed the files"""
+        if self._configs is not None:
+            # Never drop local changes that have not been logged yet
+            if self._pending or self._stat_files() == self._file_state:
+                return
+            logger.info('Configuration file %s changed, reloading', self.config_file)
+        self._configs = self._load_configs()
+        self._rebuild_indexes()
+    
+    def _stat_files(self) -> tuple:
+        """Identity of the configuration file and size of the write-ahead log"""
         try:
-            if os.path.exists(self.config_file):
-                with open(self.config_file, 'r') as f:
-                    configs = yaml.safe_load(f) or {}
-                    logger.info(f'Loaded {len(configs)} configurations from {self.config_file}')
-                    return configs
-            else:
-                logger.info(f'Configuration file {self.config_file} not found, starting with empty configs')
+            # Every checkpoint replaces the file, so the inode changes even
+            # when two checkpoints land within the same mtime tick
+            stat = os.stat(self.config_file)
+            snapshot = stat.st_ino, stat.st_mtime_ns
+        except OSError:
+            snapshot = None
+        try:
+            wal_size = os.stat(self.wal_file).st_size
+        except OSError:
+            wal_size = 0
+        return snapshot, wal_size
+    
+    def _reload_if_stale(self):
+        """Reload configurations if the files were changed by another process"""
+        if self._configs is None or self._stat_files() == self._file_state:
+            return
+        # Taking the lock reloads them, see _locked
+        with self._locked():
+            pass
+    
+    def _rebuild_indexes(self):
+        """Rebuild lookup indexes from the loaded configurations"""
+        self._by_token = {
+            config.webhook_token: config_id
+            for config_id, config in self.configs.items()
+            if config.webhook_token
+        }
+        self._by_name = {}
+        for config_id, config in self.configs.items():
+            self._by_name.setdefault(config.name, config_id)
+    
+    def _unindex_name(self, name: Optional[str], config_id: str):
+        """Remove a name from the index, falling back to another config with the same name"""
+        if self._by_name.get(name) != config_id:
+            return
+        del self._by_name[name]
+        for other_id, other in self.configs.items():
+            if other_id != config_id and other.name == name:
+                self._by_name[name] = other_id
+                break
+    
+    def _legacy_yaml_file(self) -> Optional[str]:
+        """YAML file a JSON configuration file is migrated from, if any"""
+        if _is_yaml(self.config_file):
+            return None
+        return os.path.splitext(self.config_file)[0] + '.yaml'
+    
+    def _parse_file(self, path: str) -> Dict:
+        """Parse a JSON or YAML configuration file, depending on its extension"""
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
                 return {}
+            # Map the file so the parser scans it in place without a buffered copy
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if _is_yaml(path):
+                    return yaml.load(mm, Loader=Loader) or {}
+                with memoryview(mm) as view:
+                    return orjson.loads(view) or {}
+    
+    def _serialize(self) -> bytes:
+        """Serialize configurations in the format of the configuration file"""
+        if _is_yaml(self.config_file):
+            return yaml.dump(self._as_dicts(), Dumper=Dumper, default_flow_style=False,
+                             sort_keys=False, encoding='utf-8')
+        # orjson serializes dataclasses natively
+        return orjson.dumps(self.configs, option=orjson.OPT_INDENT_2)
+    
+    def _as_dicts(self) -> Dict[str, Dict]:
+        """Configurations as plain dicts"""
+        return {config_id: asdict(config) for config_id, config in self.configs.items()}
+    
+    def _load_configs(self) -> Dict:
+        """Load configurations from the configuration file and replay the write-ahead log"""
+        try:
+            self._file_state = self._stat_files()
+            configs = self._load_snapshot()
+            self._replay_wal(configs)
+            return configs
         except Exception as e:
-            logger.error(f'Error loading configuration file: {str(e)}')
+            logger.error('Error loading configuration file: %s', e)
             return {}
     
+    def _load_snapshot(self) -> Dict:
+        """Load configurations from the last checkpoint"""
+        if os.path.exists(self.config_file):
+            configs = _to_configs(self._parse_file(self.config_file))
+            logger.info('Loaded %s configurations from %s', len(configs), self.config_file)
+            return configs
+        
+        legacy_file = self._legacy_yaml_file()
+        if legacy_file and os.path.exists(legacy_file):
+            configs = _to_configs(self._parse_file(legacy_file))
+            logger.info('Imported %s configurations from %s', len(configs), legacy_file)
+            # Persist them in the new format at the next checkpoint
+            self._dirty = True
+            return configs
+        
+        logger.info('Configuration file %s not found, starting with empty configs', self.config_file)
+        return {}
+    
+    def _replay_wal(self, configs: Dict):
+        """Apply mutations logged since the last checkpoint"""
+        try:
+            with open(self.wal_file, 'rb') as f:
+                lines = f.read().splitlines(keepends=True)
+        except FileNotFoundError:
+            return
+        
+        replayed = 0
+        offset = 0
+        for line in lines:
+            try:
+                record = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # A torn final line from a crash mid-append; cut it off so the
+                # next append starts on a fresh line
+                logger.warning('Discarding corrupt records at the end of %s', self.wal_file)
+                os.truncate(self.wal_file, offset)
+                self._file_state = self._stat_files()
+                break
+            offset += len(line)
+            op, config_id, data = record['op'], record['id'], record.get('data')
+            if op == 'add':
+                configs[config_id] = Config.from_dict(data)
+            elif op == 'delete':
+                configs.pop(config_id, None)
+            elif config_id in configs:
+                changes = {key: value for key, value in data.items() if key in _CONFIG_FIELDS}
+                configs[config_id] = replace(configs[config_id], **changes)
+            replayed += 1
+        
+        if replayed:
+            logger.info('Replayed %s mutations from %s', replayed, self.wal_file)
+    
+    def _atomic_write(self, path: str, data: bytes):
+        """Replace a file with new contents atomically"""
+        # Write to a sibling temp file and swap it in, so a crash mid-write
+        # never leaves a truncated file behind
+        target_dir = os.path.dirname(path) or '.'
+        # Temp files are created 0600; keep the target's mode, or use the mode
+        # a plain open() would have given a new file
+        try:
+            mode = S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        with tempfile.NamedTemporaryFile('wb', dir=target_dir, prefix='.configs-', delete=False) as f:
+            try:
+                os.fchmod(f.fileno(), mode)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            except Exception:
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, path)
+    
     def _save_configs(self) -> bool:
-        """Save configurations to YAML file"""
+        """Save configurations to the configuration file"""
         try:
-            with open(self.config_file, 'w') as f:
-                yaml.safe_dump(self.configs, f, default_flow_style=False, sort_keys=True)
-            logger.info(f'Saved {len(self.configs)} configurations to {self.config_file}')
+            self._atomic_write(self.config_file, self._serialize())
+            logger.info('Saved %s configurations to %s', len(self.configs), self.config_file)
+            return True
+        except Exception as e:
+            logger.error('Error saving configuration file: %s', e)
+            return False
+    
+    def to_yaml(self) -> str:
+        """Export all configurations as YAML"""
+        return yaml.dump(self._as_dicts(), Dumper=Dumper, default_flow_style=False, sort_keys=False)
+    
+    def _log_mutation(self, op: str, config_id: str, data: Optional[Dict] = None) -> bool:
+        """Record a mutation in the write-ahead log before it is applied in memory"""
+        record = {'op': op, 'id': config_id}
+        if data is not None:
+            record['data'] = data
+        with self._lock:
+            self._pending.append(orjson.dumps(record) + b'\n')
+            if self._batch_depth or self._write_wal():
+                return True
+            # The caller won't apply the mutation, so it must never reach the log
+            self._pending.pop()
+            return False
+    
+    def _write_wal(self) -> bool:
+        """Append pending mutation records to the write-ahead log"""
+        if not self._pending:
             return True
+        try:
+            with open(self.wal_file, 'ab') as f:
+                start = f.tell()
+                try:
+                    f.write(b''.join(self._pending))
+                    f.flush()
+                    os.fsync(f.fileno())
+                except Exception:
+                    # Don't leave a partial record for later appends to run into
+                    f.truncate(start)
+                    raise
+            self._pending.clear()
         except Exception as e:
-            logger.error(f'Error saving configuration file: {str(e)}')
+            logger.error('Error writing write-ahead log: %s', e)
+            return False
+        
+        self._file_state = self._stat_files()
+        return True
+    
+    def _maybe_checkpoint(self):
+        """Checkpoint once the write-ahead log has grown too large"""
+        # Only called once logged mutations are applied in memory. The records
+        # are already durable, so a failed checkpoint is simply retried later.
+        if not self._batch_depth and self._file_state[1] > WAL_CHECKPOINT_BYTES:
+            self._checkpoint()
+    
+    def _checkpoint(self) -> bool:
+        """Fold the write-ahead log into the configuration file and truncate it"""
+        if not self._save_configs():
             return False
+        # Replaying the log over the new checkpoint is harmless, so a crash
+        # before the truncation loses nothing
+        try:
+            with open(self.wal_file, 'wb'):
+                pass
+        except Exception as e:
+            logger.error('Error truncating write-ahead log: %s', e)
+        self._dirty = False
+        self._file_state = self._stat_files()
+        return True
+    
+    def flush(self) -> bool:
+        """Write pending configuration changes to disk and checkpoint the write-ahead log"""
+        if self._configs is None:
+            return True
+        with self._locked():
+            if not self._write_wal():
+                return False
+            if not self._dirty and self._file_state[1] == 0:
+                return True
+            return self._checkpoint()
+    
+    @contextmanager
+    def batch(self):
+        """Group several mutations into a single write-ahead log append"""
+        # Other threads and processes wait for the whole batch
+        with self._locked():
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                # Unwritten records stay pending and are retried by the next append or flush
+                if self._batch_depth == 0:
+                    if not self._write_wal():
+                        raise OSError(f'Failed to write configuration changes to {self.wal_file}')
+                    self._maybe_checkpoint()
+    
+    def _store_config(self, config: Config):
+        """Add or replace a configuration by swapping in an updated copy of all configurations"""
+        # Copy-on-write, so views handed out by get_all_configs stay stable snapshots
+        self._configs = {**self.configs, config.id: config}
+    
+    def _remove_config(self, config_id: str):
+        """Remove a configuration by swapping in an updated copy of all configurations"""
+        configs = dict(self.configs)
+        del configs[config_id]
+        self._configs = configs
+    
+    def _evict_client(self, config: Config):
+        """Close the shared API client of a configuration that is changing"""
+        evict_client(config.ip_address, config.api_token, config.service_type)
     
     def add_config(self, name: str, service_type: str, ip_address: str, 
                    api_token: str, quality_score: Optional[int] = None, 
-                   format_name: Optional[str] = None) -> str:
-        """Add a new configuration"""
-        config_id = str(uuid.uuid4())
-        webhook_token = str(uuid.uuid4())
+                   format_name: Optional[str] = None) -> Optional[str]:
+        """Add a new configuration, returning its webhook token (None if it could not be saved)"""
+        config_id = secrets.token_hex(16)
+        webhook_token = secrets.token_hex(16)
         
-        config = {
-            'id': config_id,
-            'name': name,
-            'service_type': service_type,
-            'ip_address': ip_address,
-            'api_token': api_token,
-            'webhook_token': webhook_token,
-            'quality_score': quality_score,
-            'format_name': format_name if format_name else None
-        }
+        config = Config(
+            id=config_id,
+            name=name,
+            service_type=service_type,
+            ip_address=ip_address,
+            api_token=api_token,
+            webhook_token=webhook_token,
+            quality_score=quality_score,
+            format_name=format_name if format_name else None
+        )
         
-        self.configs[config_id] = config
-        self._save_configs()
-        logger.info(f'Added new configuration: {name} (ID: {config_id})')
+        with self._locked():
+            if not self._log_mutation('add', config_id, asdict(config)):
+                return None
+            self._store_config(config)
+            self._by_token[webhook_token] = config_id
+            self._by_name.setdefault(name, config_id)
+            self._maybe_checkpoint()
+        logger.info('Added new configuration: %s (ID: %s)', name, config_id)
         return webhook_token
     
     def delete_config(self, config_id: str) -> bool:
         """Delete a configuration by ID"""
-        if config_id in self.configs:
-            config_name = self.configs[config_id].get('name', 'Unknown')
-            del self.configs[config_id]
-            self._save_configs()
-            logger.info(f'Deleted configuration: {config_name} (ID: {config_id})')
+        with self._locked():
+            config = self.configs.get(config_id)
+            if config is None:
+                return False
+            if not self._log_mutation('delete', config_id):
+                return False
+            self._remove_config(config_id)
+            config_name = config.name
+            self._evict_client(config)
+            self._by_token.pop(config.webhook_token, None)
+            self._unindex_name(config_name, config_id)
+            self._maybe_checkpoint()
+            logger.info('Deleted configuration: %s (ID: %s)', config_name, config_id)
             return True
-        return False
     
-    def get_config(self, config_id: str) -> Optional[Dict]:
+    def get_config(self, config_id: str) -> Optional[Config]:
         """Get a specific configuration by ID"""
+        self._reload_if_stale()
         return self.configs.get(config_id)
     
-    def get_config_by_name(self, name: str) -> Optional[Dict]:
+    def get_config_by_name(self, name: str) -> Optional[Config]:
         """Get a configuration by name (returns first match)"""
-        for config in self.configs.values():
-            if config.get('name') == name:
-                return config
-        return None
+        self._reload_if_stale()
+        configs = self.configs
+        config_id = self._by_name.get(name)
+        return configs.get(config_id) if config_id else None
     
-    def get_all_configs(self) -> Dict:
-        """Get all configurations"""
-        return self.configs.copy()
+    def get_all_configs(self) -> Mapping[str, Config]:
+        """Get a read-only snapshot of all configurations"""
+        self._reload_if_stale()
+        return MappingProxyType(self.configs)
     
-    def get_config_by_token(self, webhook_token: str) -> Optional[Dict]:
+    def get_config_by_token(self, webhook_token: str) -> Optional[Config]:
         """Find configuration by webhook token"""
-        for config in self.configs.values():
-            if config.get('webhook_token') == webhook_token:
-                return config
-        return None
+        self._reload_if_stale()
+        configs = self.configs
+        config_id = self._by_token.get(webhook_token)
+        return configs.get(config_id) if config_id else None
     
     def regenerate_webhook_token(self, config_id: str) -> Optional[str]:
         """Regenerate webhook token for a configuration"""
-        if config_id in self.configs:
-            new_token = str(uuid.uuid4())
-            self.configs[config_id]['webhook_token'] = new_token
-            config_name = self.configs[config_id].get('name', 'Unknown')
-            self._save_configs()
-            logger.info(f'Regenerated webhook token for: {config_name} (ID: {config_id})')
+        with self._locked():
+            config = self.configs.get(config_id)
+            if config is None:
+                return None
+            new_token = secrets.token_hex(16)
+            if not self._log_mutation('update', config_id, {'webhook_token': new_token}):
+                return None
+            self._by_token.pop(config.webhook_token, None)
+            config = replace(config, webhook_token=new_token)
+            self._store_config(config)
+            self._by_token[new_token] = config_id
+            config_name = config.name
+            self._maybe_checkpoint()
+            logger.info('Regenerated webhook token for: %s (ID: %s)', config_name, config_id)
             return new_token
-        return None
     
     def update_config(self, config_id: str, **kwargs) -> bool:
         """Update an existing configuration"""
-        if config_id in self.configs:
-            for key, value in kwargs.items():
-                if key in ['name', 'service_type', 'ip_address', 'api_token', 'quality_score', 'format_name']:
-                    self.configs[config_id][key] = value
-            config_name = self.configs[config_id].get('name', 'Unknown')
-            self._save_configs()
-            logger.info(f'Updated configuration: {config_name} (ID: {config_id})')
+        with self._locked():
+            config = self.configs.get(config_id)
+            if config is None:
+                return False
+            changes = {
+                key: value for key, value in kwargs.items()
+                if key in _ALLOWED_UPDATE_KEYS and getattr(config, key) != value
+            }
+            if not changes:
+                # Nothing differs from the stored values, skip logging a mutation
+                return True
+            
+            if not self._log_mutation('update', config_id, changes):
+                return False
+            self._evict_client(config)
+            old_name = config.name
+            config = replace(config, **changes)
+            self._store_config(config)
+            new_name = config.name
+            if new_name != old_name:
+                self._unindex_name(old_name, config_id)
+                self._by_name.setdefault(new_name, config_id)
+            config_name = config.name
+            self._maybe_checkpoint()
+            logger.info('Updated configuration: %s (ID: %s)', config_name, config_id)
             return True
-        return False
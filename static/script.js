@@ -92,15 +92,21 @@ function forceUnmonitor(configId) {
     })
     .then(response => response.json())
     .then(data => {
-        if (data.success) {
+        if (!data.success) {
+            throw new Error(data.error || 'Unknown error');
+        }
+        return waitForForceUnmonitorJob(data.job_id);
+    })
+    .then(status => {
+        if (status === 'done') {
             showToast('Media force updated successfully!', 'success');
         } else {
-            showToast('Failed to force update media: ' + (data.error || 'Unknown error'), 'error');
+            showToast('Failed to force update media: Processing failed', 'error');
         }
     })
     .catch(error => {
         console.error('Error force updating media:', error);
-        showToast('Failed to force update media', 'error');
+        showToast('Failed to force update media: ' + error.message, 'error');
     })
     .finally(() => {
         // Restore button state
@@ -109,6 +115,31 @@ function forceUnmonitor(configId) {
     });
 }
 
+/**
+ * Poll a force unmonitor job until it finishes
+ * @param {string} jobId - ID of the background job
+ * @returns {Promise<string>} Final job status (done or failed)
+ */
+function waitForForceUnmonitorJob(jobId) {
+    return new Promise((resolve, reject) => {
+        const poll = () => {
+            fetch(`/force_unmonitor/${encodeURIComponent(jobId)}/status`)
+            .then(response => response.json())
+            .then(data => {
+                if (!data.success) {
+                    reject(new Error(data.error || 'Unknown error'));
+                } else if (data.status === 'running') {
+                    setTimeout(poll, 2000);
+                } else {
+                    resolve(data.status);
+                }
+            })
+            .catch(reject);
+        };
+        poll();
+    });
+}
+
 /**
  * Show toast notification
  * @param {string} message - Message to display
@@ -0,0 +1,173 @@
+import os
+import atexit
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import yaml
+
+import config_manager
+from config_manager import ConfigManager
+
+
+class ConfigManagerTestCase(unittest.TestCase):
+    """Fixture running ConfigManager against files in a temp directory"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.config_file = os.path.join(self.dir, 'configs.json')
+
+    def _manager(self, config_file=None):
+        manager = ConfigManager(config_file or self.config_file)
+        # The temp directory is gone by interpreter exit
+        self.addCleanup(atexit.unregister, manager.flush)
+        return manager
+
+    def _add(self, manager, name):
+        return manager.add_config(name, 'sonarr', '127.0.0.1:8989', 'key')
+
+    def _names(self, manager):
+        return sorted(config.name for config in manager.get_all_configs().values())
+
+
+class ConfigManagerWalTest(ConfigManagerTestCase):
+    """Write-ahead log persistence of ConfigManager"""
+
+    def test_mutations_replay_from_wal(self):
+        manager = self._manager()
+        token = self._add(manager, 'A')
+        self._add(manager, 'B')
+        config_id = manager.get_config_by_token(token).id
+        manager.update_config(config_id, name='C', quality_score=5)
+        new_token = manager.regenerate_webhook_token(config_id)
+        manager.delete_config(manager.get_config_by_name('B').id)
+
+        self.assertFalse(os.path.exists(self.config_file))
+        reloaded = self._manager()
+        self.assertEqual(self._names(reloaded), ['C'])
+        self.assertEqual(reloaded.get_config_by_token(new_token), manager.get_config(config_id))
+        self.assertIsNone(reloaded.get_config_by_token(token))
+
+    def test_torn_tail_is_discarded(self):
+        manager = self._manager()
+        self._add(manager, 'A')
+        with open(manager.wal_file, 'ab') as f:
+            f.write(b'{"op":"add","id":"x","da')
+
+        reloaded = self._manager()
+        self.assertEqual(self._names(reloaded), ['A'])
+        # The next append must start on a fresh line
+        self._add(reloaded, 'B')
+        self.assertEqual(self._names(self._manager()), ['A', 'B'])
+
+    def test_flush_checkpoints_and_truncates_wal(self):
+        manager = self._manager()
+        self._add(manager, 'A')
+        self.assertTrue(manager.flush())
+
+        self.assertEqual(os.path.getsize(manager.wal_file), 0)
+        self.assertEqual(self._names(self._manager()), ['A'])
+
+    def test_checkpoint_keeps_file_mode(self):
+        manager = self._manager()
+        self._add(manager, 'A')
+        self.assertTrue(manager.flush())
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(os.stat(self.config_file).st_mode & 0o777, 0o666 & ~umask)
+
+        os.chmod(self.config_file, 0o640)
+        self._add(manager, 'B')
+        self.assertTrue(manager.flush())
+        self.assertEqual(os.stat(self.config_file).st_mode & 0o777, 0o640)
+
+    def test_large_wal_is_checkpointed(self):
+        manager = self._manager()
+        with mock.patch.object(config_manager, 'WAL_CHECKPOINT_BYTES', 1):
+            self._add(manager, 'A')
+
+        self.assertTrue(os.path.exists(self.config_file))
+        self.assertEqual(os.path.getsize(manager.wal_file), 0)
+        self.assertEqual(self._names(self._manager()), ['A'])
+
+    def test_legacy_yaml_is_imported(self):
+        legacy = {'abc': {'id': 'abc', 'name': 'Legacy', 'service_type': 'radarr',
+                          'ip_address': '127.0.0.1:7878', 'api_token': 'key',
+                          'webhook_token': 'token', 'quality_score': 10}}
+        with open(os.path.join(self.dir, 'configs.yaml'), 'w') as f:
+            yaml.safe_dump(legacy, f)
+
+        manager = self._manager()
+        self.assertEqual(manager.get_config_by_token('token').quality_score, 10)
+        self.assertTrue(manager.flush())
+        self.assertTrue(os.path.exists(self.config_file))
+
+        os.remove(os.path.join(self.dir, 'configs.yaml'))
+        self.assertEqual(self._names(self._manager()), ['Legacy'])
+
+    def test_failed_wal_write_is_reported(self):
+        manager = self._manager()
+        self._add(manager, 'A')
+        config_id = manager.get_config_by_name('A').id
+
+        with mock.patch('builtins.open', side_effect=OSError('disk full')):
+            self.assertIsNone(self._add(manager, 'B'))
+            self.assertFalse(manager.update_config(config_id, name='C'))
+            self.assertFalse(manager.delete_config(config_id))
+            self.assertIsNone(manager.regenerate_webhook_token(config_id))
+
+        self.assertEqual(self._names(manager), ['A'])
+        self.assertEqual(self._names(self._manager()), ['A'])
+
+    def test_handed_out_views_are_stable_snapshots(self):
+        manager = self._manager()
+        self._add(manager, 'A')
+        view = manager.get_all_configs()
+
+        for _ in view.values():
+            self._add(manager, 'B')
+            manager.delete_config(manager.get_config_by_name('A').id)
+
+        self.assertEqual(sorted(config.name for config in view.values()), ['A'])
+        self.assertEqual(self._names(manager), ['B'])
+
+    def test_writers_sharing_a_file_keep_each_others_changes(self):
+        first, second = self._manager(), self._manager()
+        self.assertEqual(self._names(first), [])
+        self.assertEqual(self._names(second), [])
+
+        self._add(first, 'A')
+        self._add(second, 'B')
+        self.assertTrue(first.flush())
+        self.assertTrue(second.flush())
+
+        self.assertEqual(self._names(first), ['A', 'B'])
+        self.assertEqual(self._names(self._manager()), ['A', 'B'])
+
+
+class ConfigManagerCheckpointTest(ConfigManagerTestCase):
+    """Loading configurations from a checkpointed configuration file"""
+
+    def _checkpoint(self, *names):
+        manager = self._manager()
+        for name in names:
+            self._add(manager, name)
+        self.assertTrue(manager.flush())
+        return manager
+
+    def test_restored_backup_with_older_mtime_is_loaded(self):
+        backup = self.config_file + '.bak'
+        self._checkpoint('B')
+        shutil.copy2(self.config_file, backup)
+        self._checkpoint('C')
+
+        # Restore the backup with its original, older mtime
+        shutil.copy2(backup, self.config_file)
+        self.assertEqual(self._names(self._manager()), ['B'])
+
+
+if __name__ == '__main__':
+    unittest.main()